@@ -10,12 +10,43 @@ Audits any 'k' attribute for a 'tag' element of the elements 'node' and
 
 """
 
-import xml.etree.cElementTree as ET
 import re
-from collections import defaultdict
+from collections import Counter, defaultdict
+
+from osm_file import iter_children, iter_elements
+
+# Last word of a street name
+STREET_TYPE = re.compile(r'\b\S+\.?$', re.IGNORECASE)
+
+
+def audit_many(osm_file, wanted_keys):
+    '''
+    Collects the unique values of several keys, along with the number of tags
+    having each value, in a single pass through the OSM file, instead of one 
+    pass per key as with auditOSM.audit_key
+    
+    osm_file: OSM file for auditing
+    
+    wanted_keys: key attributes of the 'tag' elements for audit
+    
+    @return: default dictionary with key as the 'k' attribute and value as 
+                Counter of its unique values
+    '''
+    wanted_keys = frozenset(wanted_keys)
+    key_values = defaultdict(Counter)
+    
+    for elem in iter_elements(osm_file, ("node", "way")):
+        for tag in iter_children(elem, "tag"):
+            k = tag.attrib['k']
+            if k in wanted_keys:
+                key_values[k][tag.attrib['v']] += 1
+    
+    return key_values
 
 
 class auditOSM(object):
+
+    __slots__ = ('osm_file', 'key', 'expected')
     
     def __init__(self, osm_file, key, expected_values = []):
         '''
@@ -30,7 +61,8 @@ class auditOSM(object):
         '''
         self.osm_file = osm_file
         self.key = key
-        self.expected = expected_values
+        # set for constant time lookups of the values being audited
+        self.expected = frozenset(expected_values)
         
      
     def is_key_match(self, elem):
@@ -57,16 +89,14 @@ class auditOSM(object):
         
         @return: list of unique values for a given key
         '''
-        osmfile = open(self.osm_file, "r")
         unique_values = set()
-        for event, elem in ET.iterparse(self.osm_file, events=("start",)):
-            if elem.tag == "node" or elem.tag == "way":
-                for tag in elem.iter("tag"):
-                    if self.is_key_match(tag):
-                        if tag.attrib['v'] not in self.expected:
-                            unique_values.add(tag.attrib['v'])               
+        
+        for elem in iter_elements(self.osm_file, ("node", "way")):
+            for tag in iter_children(elem, "tag"):
+                if self.is_key_match(tag):
+                    if tag.attrib['v'] not in self.expected:
+                        unique_values.add(tag.attrib['v'])
 
-        osmfile.close()
         return list(unique_values)
    
     
@@ -82,8 +112,7 @@ class auditOSM(object):
         street_name: String value from the tag with key = 'addr:street'
         
         '''
-        street_type_re = re.compile(r'\b\S+\.?$', re.IGNORECASE)
-        m = street_type_re.search(street_name)
+        m = STREET_TYPE.search(street_name)
         if m:
             street_type = m.group()
             if street_type not in self.expected:
@@ -101,15 +130,12 @@ class auditOSM(object):
                         type and value as street names
         '''     
         
-        osmfile = open(self.osm_file, "r")
         street_types = defaultdict(set)
         
-        for event, elem in ET.iterparse(osmfile, events=("start",)):
-            if elem.tag == "node" or elem.tag == "way":
-                for tag in elem.iter("tag"):
-                    if self.is_key_match(tag):
-                        self.audit_street_type(street_types, tag.attrib['v'])
-        osmfile.close()
+        for elem in iter_elements(self.osm_file, ("node", "way")):
+            for tag in iter_children(elem, "tag"):
+                if self.is_key_match(tag):
+                    self.audit_street_type(street_types, tag.attrib['v'])
         return street_types    
     
     
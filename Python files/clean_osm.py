@@ -2,315 +2,415 @@
 # -*- coding: utf-8 -*-
 
 """
-Code for cleaning OSM files 
+Code for cleaning OSM files
 Author: Rupa Bisaria
 
 Cleans few keys for a 'tag' element of the elements 'node' and 'way' from the OSM file
 
+The cleaning is done by module level functions taking the dirty value, mapping and
+expected values directly, so that they can be called per tag without creating an
+object. cleanOSM wraps the same functions for a single dirty value.
+
 """
 
-import xml.etree.cElementTree as ET
 import re
-from collections import defaultdict
 import string
+from functools import lru_cache
+
+# Regular expressions used for cleaning, compiled once on import
+# Street number with digits followed by letter(s), eg: 6a, 11 B, 2-A
+LETTER_GAP = re.compile(r"(\d{1,2})\s?\-?([a-z|A-Z]{1,2})\b")
+# Street number with letter preceeding the digits, eg: E11
+LETTER_DIGIT = re.compile(r"\b([A-Z])(\d{1,2})\b")
+# Street number with hyphen or space between letter and digits, eg: M-26
+LETTER_HYPHEN_DIGIT = re.compile(r"(?<!(Plot No\. ))([A-Z])[\-|\s](\d{1,2})\b")
+# Street number in brackets with a suffix, eg: (19th)
+BRACKETED_NUMBER = re.compile(r"\(?(\d{1,2})(th|rd|st|TH|nd)\)?")
+# Street number without 'Street' prefix or suffix. Exclude all string preceeded
+# by 'Street','France','Center' and '(Di)strict'
+NUMBER_WITHOUT_STREET = re.compile(r"(?<!(Street |France |Center |strict ))(\b\d{1,2}[A-Z]{1}\b)(?! Street| Sikka)")
+# Street number alone, eg: 12
+NUMBER_ONLY = re.compile(r"^(\b\d{1,2}\b)$")
+# Street number followed by 'Street', eg: 17 Street
+NUMBER_BEFORE_STREET = re.compile(r"(?<!(\d{2} ))(\b\d{1,2}[A-Z]{0,1})\s(Street)(?! \d{2})")
+# Any digit, needed by all the street number regexes above
+DIGIT = re.compile(r"\d")
+# Entry starting in english
+ENGLISH = re.compile(r'^[a-z|A-Z]+.')
+
+# City entries which can not be corrected
+WRONG_CITY_ENTRIES = ['town','ME-12','AE','San Diego, CA']
+
+# Number of compiled mapping regexes kept
+MATCHER_CACHE_SIZE = 64
+
+
+@lru_cache(maxsize=MATCHER_CACHE_SIZE)
+def build_mapping_regex(mapping_keys):
+    '''
+    Single regex matching any key of a mapping dictionary as a whole word,
+    followed by an optional '.' or '`'. Longer keys are tried first, so that
+    eg: 'St.' is preferred over 'St'.
+
+    Cached on the tuple of keys, so a mapping edited between calls gets a
+    new regex.
+
+    @return: compiled regex with the matched key as first group
+    '''
+    keys = sorted(mapping_keys, key=len, reverse=True)
+    return re.compile(r"\b(" + "|".join(re.escape(key) for key in keys) + r")\b(\.|\`)?")
+
+
+def build_expected_regex(expected_values):
+    '''
+    Single regex matching any of the expected values anywhere in a string, to
+    check for all of them in one pass. Built once per list by the callers 
+    cleaning many values, and again if the list is changed.
+
+    @return: compiled regex, never matching for an empty list
+    '''
+    if not expected_values:
+        return re.compile(r"(?!)")
+    return re.compile("|".join(re.escape(value) for value in expected_values))
+
+
+def clean_value(dirty_value, mapping):
+    '''
+    For given value and a mapping dictionary replace with the clean value
+    from the dictionary
+
+    @return : string which is cleaned version of passed string
+    '''
+    return mapping.get(dirty_value, dirty_value)
+
+
+def set_to_none():
+    '''
+    Substitute dirty value with NaN
+
+    @return : None
+    '''
+    return 'None'
+
+
+def update_street_name(dirty_value, mapping):
+    '''
+    For given street name and a mapping dictionary remove abbreviations
+    and correct case by mapping against supplied dictionary
+    eg: Sibaytah St => Sibaytah Street
+
+    @return: string which is cleaned version of passed string
+
+    '''
+
+    if not mapping:
+        return dirty_value
+
+    regex = build_mapping_regex(tuple(mapping))
+    return regex.sub(lambda m: mapping.get(m.group(1), m.group(0)), dirty_value)
+
+
+def replfunc(m):
+    '''
+    For a given regex match return with second group in uppercase and
+    remove whitespace between the groups
+
+    @return: string with second group of the regex match in uppercase
+    '''
+    return (m.group(1)+m.group(2).upper()).strip()
+
+
+def street_letter_to_uppercase_and_removegap(name):
+    '''
+    Capture a street name with digits attached to letters in  using a
+    regex and convert the attached alphabate to upper case
+    eg: Street 6a => Street 6A
+    eg: 11 B => 11B
+         2-A => 2A
+    @return: string which is cleaned version of passed string
+    '''
+    return LETTER_GAP.sub(replfunc, name)
+
+
+def switchfunc(m, index_1, index_2):
+    '''
+    For a given regex match return with group index_2 in uppercase and
+    switch position of the groups index_1 and index_2
+
+    @return: string first group of regex in upper case and the respective
+    positions of the two groups switched
+    '''
+    return m.group(index_1)+m.group(index_2).upper()
+
+
+def switch_digit_position(name):
+    '''
+    Capture street numbers with letter preceeding the digit using
+    a regex and  switch the position of digit and letter
+    eg E11 => 11E
+
+    @return: string which is cleaned version of passed string
+    '''
+    return LETTER_DIGIT.sub(lambda x: switchfunc(x,2,1), name)
+
+
+def remove_hypen_space_and_switch(name):
+    '''
+    Capture street number with hypen between digit and letter
+    using a regex and remove hyphen
+    eg: M-26 => 26M
+
+    @return: string which is cleaned version of passed string
+    '''
+    return LETTER_HYPHEN_DIGIT.sub(lambda x: switchfunc(x,3,2), name)
+
+
+def remove_brackets(name):
+    '''
+    Capture street number with brackets and 'th' suffix using a
+    regex and remove brackets and suffix 'th' or 'rd'
+    eg: Sa'ada Street (19th) => Sa'ada Street 19
+
+    @return: string which is cleaned version of passed string
+    '''
+    return BRACKETED_NUMBER.sub(lambda x:x.group(1), name)
+
+
+def add_street_prefix(name):
+    '''
+    Using regex capture check if street number is without 'Street' prefix or
+    suffix and add it as prefix
+    eg: 11B => Street 11B
+
+    @return: string which is cleaned version of passed string
+    '''
+    clean_value, count = NUMBER_WITHOUT_STREET.subn(lambda x: "Street "+x.group(2), name)
+    if count:
+        return clean_value
+    return NUMBER_ONLY.sub(lambda x: "Street "+x.group(1), name)
+
+
+def switch_number(m):
+    '''
+    For a given regex match return switched position of first and second
+    groups and insert a white space between them
+
+    @return: string with the respective positions of the two groups switched
+    '''
+    return m.group(3)+" " + m.group(2)
+
+
+def put_number_after_street(name):
+    '''
+    Capture street name with 'Street' as suffix using a regex and change it
+    to prefix
+    eg: 17 Street => Street 17
+    exception: 1 Street 17, Al Safa => 1 Street 17, Al Safa
+
+    @return: string which is cleaned version of passed string
+    '''
+    return NUMBER_BEFORE_STREET.sub(switch_number, name)
+
+
+def remove_non_street_values(name, expected_regex):
+    '''
+    Sets a name without any expected street value, as matched by the regex
+    from build_expected_regex, to None, else returns the name.
+
+    eg:
+    `Ibn Sina Medical Centre`
+    `24°26'24.5"N 54°27'03.8"E`
+    `P.O. Box 34429`
+
+    @return: string
+    '''
+    if expected_regex.search(name) is not None:
+        return name
+    return 'None'
+
+
+def extract_street(name, expected_regex):
+    '''
+    Extracts street name from the text, as the first part split on '-' or ','
+    with an expected street value matched by the regex from build_expected_regex
+
+    eg:
+    `Jumeirah Village Triangle,  District 2, Street 5 =>  Street 5`
+
+    @return: string for street name
+    '''
+    split_on = ['-',',']
+
+    for char in split_on:
+        if char in name:
+            for name_part in name.split(char):
+                if expected_regex.search(name_part) is not None:
+                    return name_part
+    return name
+
+
+# Functions cleaning the street number, in the sequence used by clean_street_name.
+# Each of their regexes needs a digit to match.
+STREET_NUMBER_CLEANERS = [remove_brackets,
+                          street_letter_to_uppercase_and_removegap,
+                          switch_digit_position,
+                          remove_hypen_space_and_switch,
+                          put_number_after_street,
+                          add_street_prefix]
+
+
+def clean_street_name(dirty_value, mapping, expected_values, expected_regex=None):
+    '''
+    Uses functions for cleaning street name in a particular sequence to get
+    clean street name for a given dirty name.
+
+    Street number cleaning is skipped for names without any digit, as none of 
+    those functions would change them.
+
+    expected_regex: build_expected_regex(expected_values), built here when not
+    given. Callers cleaning many names pass it to build it only once.
+
+    @return: string clean name for a given dirty street name
+    '''
+    clean_name = string.capwords(update_street_name(dirty_value, mapping))
+    if DIGIT.search(clean_name):
+        for clean_number in STREET_NUMBER_CLEANERS:
+            clean_name = clean_number(clean_name)
+    if expected_regex is None:
+        expected_regex = build_expected_regex(expected_values)
+    clean_name = remove_non_street_values(clean_name, expected_regex)
+    if clean_name != "None":
+        clean_name = extract_street(clean_name, expected_regex)
+    return clean_name
+
+
+def is_expected_city(dirty_value, expected_values):
+    '''
+    Entries with string matching any city name from expected city list is
+    assigned the match from the list.
+    eg:
+     'Jumeriah Lake Towers, Dubai':'Dubai',
+
+    @return : tuple (bool,string) True if match, matching city
+
+    '''
+    name = string.capwords(dirty_value)
+    # first match in list order. Most entries match one of the first few cities,
+    # so this is faster than a regex over all of them
+    city = next((value for value in expected_values if value in name), None)
+    if city is not None:
+        return (True,city)
+    return (False,'')
+
+
+def clean_city_name(dirty_value, mapping, expected_values):
+    '''
+    Entries with string matching any city name from expected city list is
+    assigned the match from the list.
+    eg:
+     'Jumeriah Lake Towers, Dubai':'Dubai',
+
+    For given street name and a mapping dictionary remove abbreviations
+    and correct case by mapping against supplied dictionary
+    eg:
+     'fujairah': 'Fujairah',
+
+    Arabic and numeric entries to 'None'. All other entries with no string
+    matching any city name from expected city list is left as is.
+
+    @return: string which is cleaned version of passed string
+    '''
+    city_status = is_expected_city(dirty_value, expected_values)
+
+    if city_status[0]:
+        return city_status[1]
+    elif dirty_value in mapping:
+        return clean_value(dirty_value, mapping)
+    elif ENGLISH.search(dirty_value):
+        if dirty_value in WRONG_CITY_ENTRIES:
+            return set_to_none()
+        else:
+            return string.capwords(dirty_value)
+    else:
+        return set_to_none()
 
 
 class cleanOSM(object):
-    
+
+    __slots__ = ('dirty_value', 'mapping', 'expected_values')
+
     def __init__(self, dirty_value, mapping = {}, expected_values = []):
         '''
         Initializes an cleanOSM instance
-        
+
         value: value attribute of an element for cleaning
-        
+
         mapping: dictionary mapping dirty values to clean values
-        
+
         expected_values: list of expected values for the given key
-                
+
         '''
         self.dirty_value = dirty_value
         self.mapping = mapping
         self.expected_values = expected_values
-           
+
+    @classmethod
+    def clean_map(cls, dirty_values, mapping):
+        '''
+        For given values and a mapping dictionary replace each value with the
+        clean value from the dictionary, without an instance per value
+
+        @return : list of clean values, in the order of the given values
+        '''
+        return [mapping.get(dirty_value, dirty_value) for dirty_value in dirty_values]
+
     def clean_value(self):
         '''
         For given value and a mapping dictionary replace with the clean value
         from the dictionary
-        
+
         @return : string which is cleaned version of passed string
         '''
-        if self.dirty_value in self.mapping.keys():
-            return self.mapping[self.dirty_value]
-        else:
-            return self.dirty_value
-    
+        return clean_value(self.dirty_value, self.mapping)
+
     def set_to_none(self):
         '''
         Substitute dirty value with NaN
-        
+
         @return : None
         '''
-        return 'None'
-                           
+        return set_to_none()
 
     def update_street_name(self):
         '''
-        For given street name and a mapping dictionary remove abbreviations 
+        For given street name and a mapping dictionary remove abbreviations
         and correct case by mapping against supplied dictionary
-        eg: Sibaytah St => Sibaytah Street
-
-        @return: string which is cleaned version of passed string
-
-        '''
-        
-        clean_value = self.dirty_value
-        
-        # Iterate over each key in 'mapping'
-        for key in self.mapping:
-            # check if the key is in the street name
-            if key in self.dirty_value:
-                key_regex = r"\b(" + key + r")\b(\.|\`)?"
-                
-                # check for the regex and substitute it for the value of key in 'mapping'
-                if re.search(key_regex, self.dirty_value):
-                    clean_value = re.sub(key_regex, self.mapping[key], self.dirty_value)   
-                    
-        return clean_value
-
-        
-    def replfunc(self, m):
-        '''
-        For a given regex match return with second group in uppercase and 
-        remove whitespace between the groups
-
-        @return: string with second group of the regex match in uppercase
-        '''
-        return (m.groups()[0]+m.groups()[1].upper()).strip()
-
-
-    def street_letter_to_uppercase_and_removegap(self, name):
-        '''           
-        Capture a street name with digits attached to letters in  using a 
-        regex and convert the attached alphabate to upper case
-        eg: Street 6a => Street 6A
-        eg: 11 B => 11B
-             2-A => 2A
-        @return: string which is cleaned version of passed string
-        '''
-        clean_value = name
-        
-        # regex for getting street number with digits followed letter(s)
-        regex = r"(\d{1,2})\s?\-?([a-z|A-Z]{1,2})\b"
-        
-        if re.search(regex, name):
-            return re.sub(regex, lambda x: self.replfunc(x), name) 
-        return clean_value
-    
-        
-    def switchfunc(self, m, index_1, index_2):
-        '''
-        For a given regex match return with first group in uppercase and 
-        switch position of first and second groups
-
-        @return: string first group of regex in upper case and the respective
-        positions of the two groups switched
-        '''
-        return m.groups()[index_1]+m.groups()[index_2].upper()
-
-        
-    def switch_digit_position(self, name):
-        '''
-        Capture street numbers with letter preceeding the digit using 
-        a regex and  switch the position of digit and letter
-        eg E11 => 11E
-        
-        @return: string which is cleaned version of passed string
-        '''
-        # regex for getting street number with digits followed letter(s)
-        clean_value = name
-        regex = r"\b([A-Z])(\d{1,2})\b"
-        if re.search(regex, name):
-            return re.sub(regex, lambda x: self.switchfunc(x,1,0), name) 
-        return clean_value
-
-        
-    def remove_hypen_space_and_switch(self, name):
-        '''
-        Capture street number with hypen between digit and letter 
-        using a regex and remove hyphen 
-        eg: M-26 => 26M
-        
-        @return: string which is cleaned version of passed string
-        '''
-        clean_value = name
-        regex = r"(?<!(Plot No\. ))([A-Z])[\-|\s](\d{1,2})\b"
-        if re.search(regex, name):
-            return re.sub(regex, lambda x: self.switchfunc(x,2,1), name) 
-        return clean_value
 
-        
-    def remove_brackets(self, name):
-        '''
-        Capture street number with brackets and 'th' suffix using a 
-        regex and remove brackets and suffix 'th' or 'rd'
-        eg: Sa'ada Street (19th) => Sa'ada Street 19
-        
         @return: string which is cleaned version of passed string
         '''
-        clean_value = name
-        regex = r"\(?(\d{1,2})(th|rd|st|TH|nd)\)?"
-        if re.search(regex, name):
-            return re.sub(regex, lambda x:x.groups()[0], name) 
-        return clean_value
-
-    
-    def add_street_prefix(self, name):
-        '''
-        Using regex capture check if street number is without 'Street' prefix or 
-        suffix and add it as prefix
-        eg: 11B => Street 11B  
-        
-        @return: string which is cleaned version of passed string
-        '''
-        clean_value = name
-        # Exclude all string preceeded by 'Street','France','Center' and '(Di)strict'
-        regex = r"(?<!(Street |France |Center |strict ))(\b\d{1,2}[A-Z]{1}\b)(?! Street| Sikka)"
-        regex_1 = r"^(\b\d{1,2}\b)$"
-        if re.search(regex, name):
-            return re.sub(regex, lambda x: "Street "+x.groups()[1], name) 
-        elif re.search(regex_1, name):
-            return re.sub(regex_1, lambda x: "Street "+x.groups()[0], name) 
-        
-        return clean_value
-
-       
-    def switch_number(self, m):
-        '''
-        For a given regex match return switched position of first and second 
-        groups and insert a white space between them
-        
-        @return: string with the respective positions of the two groups switched
-        '''
-        return m.groups()[2]+" " + m.groups()[1]
-
-        
-    def put_number_after_street(self, name):
-        '''
-        Capture street name with 'Street' as suffix using a regex and change it 
-        to prefix
-        eg: 17 Street => Street 17
-        exception: 1 Street 17, Al Safa => 1 Street 17, Al Safa
-        
-        @return: string which is cleaned version of passed string
-        '''
-        clean_value = name
-        regex = r"(?<!(\d{2} ))(\b\d{1,2}[A-Z]{0,1})\s(Street)(?! \d{2})"
-        if re.search(regex, name):
-            return re.sub(regex, lambda x: self.switch_number(x), name) 
-        return clean_value
-    
-    def remove_non_street_values(self, name):
-        '''
-        Sets a name not in the expected street list to None, else returns 
-        the name.
-        
-        eg: 
-        `Ibn Sina Medical Centre`
-        `24°26'24.5"N 54°27'03.8"E`
-        `P.O. Box 34429`
-        
-        @return: string 
-        '''
-        if any(value in name for value in self.expected_values):
-            return name
-        return 'None'
-
-    def extract_street(self, name):
-        '''
-        Extracts street name from the text
-        
-        eg: 
-        `Jumeirah Village Triangle,  District 2, Street 5 =>  Street 5`
-        
-        @return: string for street name
-        '''
-        split_on = ['-',',']
-
-        for char in split_on:
-            if char in name:
-                for name_part in name.split(char):
-                    if any(value in name_part for value in self.expected_values): 
-                        return name_part
-        return name
+        return update_street_name(self.dirty_value, self.mapping)
 
     def clean_street_name(self):
         '''
-        Uses functions for cleaning street name in a particular sequence to get
-        clean street name for a given dirty name.
-        
+        Cleans the street name, see clean_street_name function
+
         @return: string clean name for a given dirty street name
         '''
-        clean_name = self.update_street_name()
-        clean_name = self.remove_brackets(string.capwords(clean_name))
-        clean_name = self.street_letter_to_uppercase_and_removegap(clean_name) 
-        clean_name = self.switch_digit_position(clean_name) 
-        clean_name = self.remove_hypen_space_and_switch(clean_name) 
-        clean_name = self.put_number_after_street(clean_name) 
-        clean_name = self.add_street_prefix(clean_name) 
-        clean_name = self.remove_non_street_values(clean_name)
-        if clean_name != "None":
-            clean_name = self.extract_street(clean_name)
-        return clean_name
-    
+        return clean_street_name(self.dirty_value, self.mapping, self.expected_values)
+
     def is_expected_city(self):
         '''
-        Entries with string matching any city name from expected city list is 
-        assigned the match from the list.
-        eg: 
-         'Jumeriah Lake Towers, Dubai':'Dubai',
-        
+        Checks the value against the expected city list, see is_expected_city
+        function
+
         @return : tuple (bool,string) True if match, matching city
-        
         '''
-        
-        for value in self.expected_values:
-            if value in string.capwords(self.dirty_value):
-                return (True,value)
-        return (False,'')
-    
+        return is_expected_city(self.dirty_value, self.expected_values)
+
     def clean_city_name(self):
         '''
-        Entries with string matching any city name from expected city list is 
-        assigned the match from the list.
-        eg: 
-         'Jumeriah Lake Towers, Dubai':'Dubai',
-        
-        For given street name and a mapping dictionary remove abbreviations 
-        and correct case by mapping against supplied dictionary
-        eg:       
-         'fujairah': 'Fujairah',
-         
-        Arabic and numeric entries to 'None'. All other entries with no string
-        matching any city name from expected city list is left as is.      
-        
+        Cleans the city name, see clean_city_name function
+
         @return: string which is cleaned version of passed string
         '''
-        city_status = self.is_expected_city()
-        regex_english = re.compile(r'^[a-z|A-Z]+.')
-        wrong_entry = ['town','ME-12','AE','San Diego, CA']
-        
-        if city_status[0]:
-            return city_status[1]
-        elif self.dirty_value in self.mapping.keys():
-            return self.clean_value()
-        elif regex_english.search(self.dirty_value):
-            if self.dirty_value in wrong_entry:
-                return self.set_to_none()
-            else:
-                return string.capwords(self.dirty_value)         
-        else:
-            return self.set_to_none()
-            
-   
-        
-        
\ No newline at end of file
+        return clean_city_name(self.dirty_value, self.mapping, self.expected_values)
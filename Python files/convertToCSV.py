@@ -8,7 +8,7 @@ format to tabular format for converting into csv files.
 The process for this transformation is as follows:
 - Iterparse to iteratively step through each top level element in the XML
 - Shape each element into several data structures using a custom function
-- Utilize a schema and validation library to ensure the transformed data is in the 
+- Utilize a schema and a validator built from it to ensure the transformed data is in the 
   correct format
 - Write each data structure to the appropriate .csv files
 
@@ -31,6 +31,9 @@ The "node" field holds a dictionary of the following top level node attributes:
 - timestamp
 - changeset
 
+lat and lon are converted to integers in units of 1e-7 degree, the precision of 
+the coordinates in OSM files.
+
 The "node_tags" field holds a list of dictionaries, one per secondary tag. Each dictionary 
 have the following fields from the secondary tag attributes:
 - id: the top level node id attribute value
@@ -76,15 +79,14 @@ Provided by Upacity
 
 
 import csv
-import codecs
 import pprint
-import re
-import xml.etree.cElementTree as ET
-
-import cerberus
+import string
+from functools import lru_cache
+from operator import itemgetter
 
 import schema
-from clean_osm import cleanOSM
+from clean_osm import build_expected_regex, clean_street_name, clean_value, clean_city_name, set_to_none
+from osm_file import iter_children, iter_elements
 
 NODES_PATH = "nodes.csv"
 NODE_TAGS_PATH = "nodes_tags.csv"
@@ -92,9 +94,14 @@ WAYS_PATH = "ways.csv"
 WAY_NODES_PATH = "ways_nodes.csv"
 WAY_TAGS_PATH = "ways_tags.csv"
 
-LOWER_COLON = re.compile(r'^([a-z]|_)+:([a-z]|_)+')
-PROBLEMCHARS = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
-ARABICKEY = re.compile(r'((\:ar)|\b(ar))$$')
+# Write buffer for each csv file, rows are flushed to disk in 1MB blocks
+CSV_BUFFER_SIZE = 1 << 20
+
+# Characters allowed on either side of the colon in a key with a type, eg: addr:street
+LOWER_CHARS = frozenset(string.ascii_lowercase + '_')
+# Characters not allowed in a tag key. Checked as a set, which is several times
+# faster than a regex search on short keys
+PROBLEM_KEY_CHARS = frozenset('=+/&<>;\'"?%#$@,. \t\r\n')
 
 mapping_street_name = { 
             "St.": "Street",
@@ -157,6 +164,10 @@ mapping_building = {
 }
 SCHEMA = schema.schema
 
+# Scale of lat/lon stored as integers, in units of 1e-7 degree as in OSM files
+COORDINATE_SCALE = 10 ** 7
+COORDINATE_FIELDS = ('lat', 'lon')
+
 # Make sure the fields order in the csvs matches the column order in the sql table schema
 NODE_FIELDS = ['id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset', 'timestamp']
 NODE_TAGS_FIELDS = ['id', 'key', 'value', 'type']
@@ -164,21 +175,150 @@ WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
 WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
 WAY_NODES_FIELDS = ['id', 'node_id', 'position']
 
+# Values of a shaped row dict in the order of the csv fields, used to write the rows 
+# with csv.writer, which is faster than csv.DictWriter checking the keys of each row
+NODE_VALUES = itemgetter(*NODE_FIELDS)
+NODE_TAGS_VALUES = itemgetter(*NODE_TAGS_FIELDS)
+WAY_VALUES = itemgetter(*WAY_FIELDS)
+WAY_TAGS_VALUES = itemgetter(*WAY_TAGS_FIELDS)
+WAY_NODES_VALUES = itemgetter(*WAY_NODES_FIELDS)
+
+# Maximum number of distinct street names whose cleaned value is kept
+STREET_CACHE_SIZE = 4096
+# Regex matching any expected street value, built once for all the street names
+EXPECTED_STREET_REGEX = build_expected_regex(expected_street_name)
+
+
+@lru_cache(maxsize=STREET_CACHE_SIZE)
+def clean_street(v):
+    """Clean a street name, cached since the same street is in the address of many elements"""
+    return clean_street_name(v, mapping_street_name, expected_street_name, EXPECTED_STREET_REGEX)
+
+
+# Cleaning function for each tag key to be cleaned, all other values are kept as is
+CLEANERS = {
+    'addr:street': clean_street,
+    'building': lambda v: clean_value(v, mapping_building),
+    'surface': lambda v: clean_value(v, mapping_surface),
+    'oneway': lambda v: set_to_none(),
+    'addr:city': lambda v: clean_city_name(v, mapping_city, expected_cities)
+}
 
-class UnicodeDictWriter(csv.DictWriter, object):
-        """Extend csv.DictWriter to handle Unicode input"""
-
-        def writerow(self, row):
-            super(UnicodeDictWriter, self).writerow({
-                k: (v.encode('utf-8') if isinstance(v, unicode) else v) for k, v in row.iteritems()
-            })
 
-        def writerows(self, rows):
-            for row in rows:
-                self.writerow(row)
+def shape_tag(elem_id, k, v, default_tag_type, cleaners):
+    """Clean the value of a secondary tag and shape it to Python dict"""
+    tag_attrib = {}
+    tag_attrib['id'] = elem_id
+    
+    cleaner = cleaners.get(k)
+    tag_attrib['value'] = cleaner(v) if cleaner is not None else v
+    
+    # Same as matching r'^([a-z]|_)+:([a-z]|_)+' but without the regex engine
+    tag_type, colon, key = k.partition(':')
+    if colon and key and key[0] in LOWER_CHARS and tag_type and LOWER_CHARS.issuperset(tag_type):
+        tag_attrib['type'], tag_attrib['key'] = tag_type, key
+    else:
+        tag_attrib['key'] = k
+        tag_attrib['type'] = default_tag_type
+    
+    return tag_attrib
+
+
+try:
+    from shape_tag_c import shape_tag as compiled_shape_tag
+except ImportError:
+    compiled_shape_tag = None
+
+# shape_tag function used by shape_element, the compiled one when it has been
+# built from shape_tag_c.pyx
+TAG_SHAPER = compiled_shape_tag if compiled_shape_tag is not None else shape_tag
+
+
+def to_fixed_point(coordinate):
+    """Convert a lat/lon attribute to an integer number of 1e-7 degree, None if missing"""
+    if coordinate is None:
+        return None
+    return int(round(float(coordinate) * COORDINATE_SCALE))
+
+
+def is_arabic_key(k):
+    """Return True for keys of arabic entries, ie ending in a separate word 'ar' eg: name:ar"""
+    return k.endswith('ar') and (len(k) == 2 or not (k[-3].isalnum() or k[-3] == '_'))
+
+
+# Python types for the schema types
+SCHEMA_TYPES = {'integer': int, 'float': (float, int), 'string': str, 'dict': dict, 'list': list}
+
+
+def build_rule_check(rules, field=None):
+    """
+    Build a function checking a value against the rules of one schema field:
+    type, coerce and a nested schema for dict values or list items. Returns a 
+    list of errors for the value, empty if it is valid. As with cerberus, a 
+    failed coercion is reported after the null or type error it leads to.
+    """
+    type_name = rules['type']
+    value_type = SCHEMA_TYPES[type_name]
+    coerce = rules.get('coerce')
+    nested_check = None
+    if 'schema' in rules:
+        if type_name == 'dict':
+            nested_check = build_validator(rules['schema'])
+        elif type_name == 'list':
+            item_check = build_rule_check(rules['schema'])
+            nested_check = lambda items: {i: errors for i, errors in 
+                                          ((i, item_check(item)) for i, item in enumerate(items)) 
+                                          if errors}
+
+    def check(value):
+        coerce_errors = []
+        if coerce is not None:
+            try:
+                value = coerce(value)
+            except (TypeError, ValueError) as e:
+                coerce_errors = ["field '{0}' cannot be coerced: {1}".format(field, e)]
+        if value is None:
+            return ['null value not allowed'] + coerce_errors
+        if not isinstance(value, value_type):
+            return ['must be of {0} type'.format(type_name)] + coerce_errors
+        if nested_check is not None:
+            errors = nested_check(value)
+            if errors:
+                return [errors] + coerce_errors
+        return coerce_errors
+    return check
+
+
+def build_validator(schema):
+    """
+    Build a function validating a dict against a schema in the cerberus format of
+    schema.py, reporting unknown and missing required fields as well as the errors
+    of each field. The schema is walked only once here, instead of once per element
+    as by cerberus.Validator. Returns a dict of errors by field, empty if valid.
+    """
+    checks = [(field, build_rule_check(rules, field), rules.get('required', False)) 
+              for field, rules in schema.items()]
+
+    def validate(document):
+        errors = {field: ['unknown field'] for field in document if field not in schema}
+        for field, check, required in checks:
+            if field in document:
+                field_errors = check(document[field])
+                if field_errors:
+                    errors[field] = field_errors
+            elif required:
+                errors[field] = ['required field']
+        return errors
+    return validate
+
+
+# Validator for shaped elements, built once on import
+ELEMENT_VALIDATOR = build_validator(SCHEMA)
 
 
 class ConvertToCSV(object):
+
+    __slots__ = ('osm_file', 'validate')
     
     def __init__(self, osm_file, validate):
         '''
@@ -194,133 +334,64 @@ class ConvertToCSV(object):
           
      
     def shape_element(self, element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIELDS,
-                      problem_chars=PROBLEMCHARS, arabic_chars = ARABICKEY, default_tag_type='regular'):
+                      problem_chars=PROBLEM_KEY_CHARS, default_tag_type='regular', 
+                      cleaners=CLEANERS, tag_shaper=TAG_SHAPER):
         """Clean and shape node or way XML element to Python dict"""
 
-        node_attribs = {}
-        way_attribs = {}
-        way_nodes = []
         tags = []  
+        element_id = element.get('id')
+        # set test for problem chars in tag keys, bound once per element
+        no_problem_chars = problem_chars.isdisjoint
 
         if element.tag == 'node':
             
-            for i in range(len(node_attr_fields)):
-                node_attribs[node_attr_fields[i]] = element.get(node_attr_fields[i])
+            node_attribs = {field: element.get(field) for field in node_attr_fields}
+            for field in COORDINATE_FIELDS:
+                if field in node_attribs:
+                    node_attribs[field] = to_fixed_point(node_attribs[field])
                 
-            for tag in element.iter("tag"):
-                if re.search(problem_chars, tag.attrib['k']):
+            for tag in iter_children(element, "tag"):
+                attrib = tag.attrib
+                k = attrib['k']
+                if not no_problem_chars(k):
                     continue
-                if re.search(arabic_chars, tag.attrib['k']):
+                if is_arabic_key(k):
                     continue
 
-                tag_attrib = {}
-                tag_attrib['id'] = element.get('id')
-
-                # Clean street names
-                if (tag.attrib['k'] == "addr:street"):
-                    tag_attrib['value'] = cleanOSM(tag.attrib['v'], mapping_street_name, expected_street_name).clean_street_name() 
-
-                # Clean building
-                elif (tag.attrib['k'] == "building"):
-                    tag_attrib['value'] = cleanOSM(tag.attrib['v'], mapping_building).clean_value()
-
-                # Clean surface
-                elif (tag.attrib['k'] == "surface"):
-                    tag_attrib['value'] = cleanOSM(tag.attrib['v'], mapping_surface).clean_value()
-    
-                # Clean oneway
-                elif (tag.attrib['k'] == "oneway"):
-                    tag_attrib['value'] = cleanOSM(tag.attrib['v']).set_to_none()
-    
-                # Clean city names
-                elif (tag.attrib['k'] == "addr:city"):
-                    tag_attrib['value'] = cleanOSM(tag.attrib['v'],  mapping_city, expected_cities).clean_city_name()
-
-                else:
-                    tag_attrib['value'] = tag.attrib['v']
-                    
-                if re.search(LOWER_COLON, tag.attrib['k']):
-                    tag_attrib['type'], tag_attrib['key'] =  tag.attrib['k'].split(':',1)
-                else:
-                    tag_attrib['key'] =  tag.attrib['k']
-                    tag_attrib['type'] = default_tag_type
-                                 
-                tags.append(tag_attrib)
+                tags.append(tag_shaper(element_id, k, attrib['v'], default_tag_type, cleaners))
                 
             return {'node': node_attribs, 'node_tags': tags}
         
         elif element.tag == 'way':
             
-            for i in range(len(way_attr_fields)):
-                way_attribs[way_attr_fields[i]] = element.get(way_attr_fields[i])
-
-            nd_index = 0
-            for nd in element.iter("nd"):
-                nd_attrib = {}
-                nd_attrib['id'] = element.get('id')
-                nd_attrib['node_id'] = nd.attrib['ref']
-                nd_attrib['position'] = nd_index
-                nd_index += 1
-                way_nodes.append(nd_attrib)
-
-            for tag in element.iter("tag"):
-                if re.search(PROBLEMCHARS, tag.attrib['k']):
-                    continue
-                if re.search(arabic_chars, tag.attrib['k']):
-                    continue
-                    
-                tag_attrib = {}
-                tag_attrib['id'] = element.get('id')
-                
-                # Clean street names
-                if (tag.attrib['k'] == "addr:street"):
-                    tag_attrib['value'] = cleanOSM(tag.attrib['v'], mapping_street_name, expected_street_name).clean_street_name() 
+            way_attribs = {field: element.get(field) for field in way_attr_fields}
 
-                # Clean building
-                elif (tag.attrib['k'] == "building"):
-                    tag_attrib['value'] = cleanOSM(tag.attrib['v'], mapping_building).clean_value()
+            way_nodes = [{'id': element_id, 'node_id': nd.get('ref'), 'position': position}
+                         for position, nd in enumerate(iter_children(element, "nd"))]
 
-                # Clean surface
-                elif (tag.attrib['k'] == "surface"):
-                    tag_attrib['value'] = cleanOSM(tag.attrib['v'], mapping_surface).clean_value()
-    
-                # Clean oneway
-                elif (tag.attrib['k'] == "oneway"):
-                    tag_attrib['value'] = cleanOSM(tag.attrib['v']).set_to_none()
-    
-                # Clean city names
-                elif (tag.attrib['k'] == "addr:city"):
-                    tag_attrib['value'] = cleanOSM(tag.attrib['v'],  mapping_city, expected_cities).clean_city_name()
-                
-                else:
-                    tag_attrib['value'] = tag.attrib['v']
+            for tag in iter_children(element, "tag"):
+                attrib = tag.attrib
+                k = attrib['k']
+                if not no_problem_chars(k):
+                    continue
+                if is_arabic_key(k):
+                    continue
                     
-                if re.search(LOWER_COLON, tag.attrib['k']):
-                    tag_attrib['type'], tag_attrib['key'] =  tag.attrib['k'].split(':',1)
-                else:
-                    tag_attrib['key'] =  tag.attrib['k']
-                    tag_attrib['type'] = default_tag_type
-                                  
-                tags.append(tag_attrib)
+                tags.append(tag_shaper(element_id, k, attrib['v'], default_tag_type, cleaners))
                 
             return {'way': way_attribs, 'way_nodes': way_nodes, 'way_tags': tags}
 
     
     def get_element(self, tags=('node', 'way', 'relation')):
-        """Yield element if it is the right type of tag"""
-
-        context = ET.iterparse(self.osm_file, events=('start', 'end'))
-        _, root = next(context)
-        for event, elem in context:
-            if event == 'end' and elem.tag in tags:
-                yield elem
-                root.clear()
+        """Yield element if it is the right type of tag, filtered by the parser with lxml"""
+        return iter_elements(self.osm_file, tags)
 
 
-    def validate_element(self, element, validator, schema=SCHEMA):
+    def validate_element(self, element, validator=ELEMENT_VALIDATOR):
         """Raise ValidationError if element does not match schema"""
-        if validator.validate(element, schema) is not True:
-            field, errors = next(validator.errors.iteritems())
+        element_errors = validator(element)
+        if element_errors:
+            field, errors = next(iter(element_errors.items()))
             message_string = "\nElement of type '{0}' has the following errors:\n{1}"
             error_string = pprint.pformat(errors)
 
@@ -330,37 +401,34 @@ class ConvertToCSV(object):
     def process_map(self):
         """Iteratively process each XML element and write to csv(s)"""
 
-        with codecs.open(NODES_PATH, 'w') as nodes_file, \
-            codecs.open(NODE_TAGS_PATH, 'w') as nodes_tags_file, \
-            codecs.open(WAYS_PATH, 'w') as ways_file, \
-            codecs.open(WAY_NODES_PATH, 'w') as way_nodes_file, \
-            codecs.open(WAY_TAGS_PATH, 'w') as way_tags_file:
-
-            nodes_writer = UnicodeDictWriter(nodes_file, NODE_FIELDS)
-            node_tags_writer = UnicodeDictWriter(nodes_tags_file, NODE_TAGS_FIELDS)
-            ways_writer = UnicodeDictWriter(ways_file, WAY_FIELDS)
-            way_nodes_writer = UnicodeDictWriter(way_nodes_file, WAY_NODES_FIELDS)
-            way_tags_writer = UnicodeDictWriter(way_tags_file, WAY_TAGS_FIELDS)
+        with open(NODES_PATH, 'w', CSV_BUFFER_SIZE, encoding='utf-8', newline='') as nodes_file, \
+            open(NODE_TAGS_PATH, 'w', CSV_BUFFER_SIZE, encoding='utf-8', newline='') as nodes_tags_file, \
+            open(WAYS_PATH, 'w', CSV_BUFFER_SIZE, encoding='utf-8', newline='') as ways_file, \
+            open(WAY_NODES_PATH, 'w', CSV_BUFFER_SIZE, encoding='utf-8', newline='') as way_nodes_file, \
+            open(WAY_TAGS_PATH, 'w', CSV_BUFFER_SIZE, encoding='utf-8', newline='') as way_tags_file:
 
-            nodes_writer.writeheader()
-            node_tags_writer.writeheader()
-            ways_writer.writeheader()
-            way_nodes_writer.writeheader()
-            way_tags_writer.writeheader()
+            nodes_writer = csv.writer(nodes_file)
+            node_tags_writer = csv.writer(nodes_tags_file)
+            ways_writer = csv.writer(ways_file)
+            way_nodes_writer = csv.writer(way_nodes_file)
+            way_tags_writer = csv.writer(way_tags_file)
 
-            validator = cerberus.Validator()
+            nodes_writer.writerow(NODE_FIELDS)
+            node_tags_writer.writerow(NODE_TAGS_FIELDS)
+            ways_writer.writerow(WAY_FIELDS)
+            way_nodes_writer.writerow(WAY_NODES_FIELDS)
+            way_tags_writer.writerow(WAY_TAGS_FIELDS)
 
             for element in self.get_element(tags=('node', 'way')):
                 el = self.shape_element(element)
                 if el:
                     if self.validate is True:
-                        self.validate_element(el, validator)
-
-                    if element.tag == 'node':
-                        nodes_writer.writerow(el['node'])
-                        node_tags_writer.writerows(el['node_tags'])
-                    elif element.tag == 'way':
-                        ways_writer.writerow(el['way'])
-                        way_nodes_writer.writerows(el['way_nodes'])
-                        way_tags_writer.writerows(el['way_tags'])
-                        
\ No newline at end of file
+                        self.validate_element(el)
+
+                    if 'node' in el:
+                        nodes_writer.writerow(NODE_VALUES(el['node']))
+                        node_tags_writer.writerows(map(NODE_TAGS_VALUES, el['node_tags']))
+                    elif 'way' in el:
+                        ways_writer.writerow(WAY_VALUES(el['way']))
+                        way_nodes_writer.writerows(map(WAY_NODES_VALUES, el['way_nodes']))
+                        way_tags_writer.writerows(map(WAY_TAGS_VALUES, el['way_tags']))
@@ -14,17 +14,100 @@ file. This makes auditing and cleaning much faster. Finally, whole of OSM file m
 taken for final auditing, cleaning and analysis.
 
 ## Get Element Function
-The function takes the osm file and yield tag elements 'node', 'way' and 'relation'
+The function takes the osm file and yield tag elements 'node', 'way' and 'relation'.
+lxml is used for parsing when available, else ElementTree.
 
 ## Create Sample File Function
 The function takes the osm file and extacts every n-th element from it and creates 
-and writes an osm sample file.
+and writes an osm sample file. With lxml the elements are written with its incremental 
+xml writer.
 
 """
 
-import xml.etree.cElementTree as ET
+try:
+    from lxml import etree as ET
+    LXML = True
+except ImportError:
+    import xml.etree.ElementTree as ET
+    LXML = False
+
+# Iterates the child elements of a given tag of an element, eg: iter_children(elem, 'tag').
+# lxml walks only the direct children, where 'tag' and 'nd' elements are in an osm file,
+# which is faster than elem.iter() or a compiled XPath; ElementTree has no equivalent 
+# so its (C) descendant walk is used
+if LXML:
+    iter_children = ET._Element.iterchildren
+else:
+    iter_children = ET.Element.iter
+
+# Write buffer for the sample file, written to disk in 1MB blocks
+SAMPLE_BUFFER_SIZE = 1 << 20
+
+
+# Top level elements under the root 'osm' element of an osm file
+OSM_ELEMENTS = ('bounds', 'node', 'way', 'relation')
+
+
+def iter_elements(osm_file, tags=('node', 'way', 'relation'), stride=1):
+    '''
+    Yields every stride-th top level element of the given tags from the osm file, 
+    clearing each top level element, yielded or not, once the caller is done with
+    it so that memory use stays flat
+    
+    With lxml the tags are filtered while parsing and already processed siblings
+    are deleted from the tree, since clearing the root does not free them. The 
+    filter also lets through the other top level elements (OSM_ELEMENTS), so that
+    those after the last wanted element (eg: the relations at the end of the file 
+    when only nodes and ways are wanted) are freed as well. Otherwise falls back to 
+    the ElementTree start/end pattern, clearing the root at the end of every top 
+    level element.
+    
+    osm_file: OSM file to be parsed
+    
+    tags: tag elements to be extracted from osm_file
+    
+    stride: yield only every stride-th element of the given tags, starting with the
+            first one, the others are skipped within the parsing loop
+    
+    Reference:
+    http://lxml.de/parsing.html#modifying-the-tree
+    '''
+    tags = frozenset(tags)
+    # number of wanted elements still to be skipped before the next one is yielded
+    skip = 0
+    if LXML:
+        for _, elem in ET.iterparse(osm_file, events=('end',), tag=tuple(tags.union(OSM_ELEMENTS)), 
+                                    huge_tree=True):
+            if elem.tag in tags:
+                if not skip:
+                    yield elem
+                    skip = stride
+                skip -= 1
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+    else:
+        context = iter(ET.iterparse(osm_file, events=('start', 'end')))
+        _, root = next(context)
+        depth = 0
+        
+        for event, elem in context:
+            if event == 'start':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    if elem.tag in tags:
+                        if not skip:
+                            yield elem
+                            skip = stride
+                        skip -= 1
+                    root.clear()
+
 
 class OSMFile(object):
+
+    __slots__ = ('osm_file', 'sample_size', 'sample_file')
     
     def __init__(self, osm_file, sample_file, sample_size):
         '''
@@ -43,23 +126,19 @@ class OSMFile(object):
         self.sample_file = sample_file
         
     
-    def get_element(self, tags=('node', 'way', 'relation')):
+    def get_element(self, tags=('node', 'way', 'relation'), stride=1):
         '''
-        Yields element if it is the right type of tag
+        Yields element if it is the right type of tag. With lxml only the 'end'
+        events of the given tags are produced by the parser.
 
         tags: tag elements to be extracted from osm_file 
+        
+        stride: yield only every stride-th element, see iter_elements
 
         Reference:
         http://stackoverflow.com/questions/3095434/inserting-newlines-in-xml-file-generated-via-xml-etree-elementtree-in-python
         '''
-
-        context = iter(ET.iterparse(self.osm_file, events=('start', 'end')))
-        _, root = next(context)
-        
-        for event, elem in context:
-            if event == 'end' and elem.tag in tags:
-                yield elem
-                root.clear()
+        return iter_elements(self.osm_file, tags, stride)
             
     def create_sample_file(self):
         '''
@@ -72,16 +151,28 @@ class OSMFile(object):
         
         '''
         k = self.sample_size
+        # Every kth top level element, the ones in between are only parsed
+        elements = self.get_element(stride=k)
         
-        with open(self.sample_file, 'wb') as output: 
-            output.write('<?xml version="1.0" encoding="UTF-8"?>\n') 
-            output.write('<osm>\n ')
+        with open(self.sample_file, 'wb', SAMPLE_BUFFER_SIZE) as output: 
+            if LXML:
+                # Incremental writer, serializing each element straight to the output
+                with ET.xmlfile(output, encoding='utf-8') as xf:
+                    xf.write_declaration()
+                    with xf.element('osm'):
+                        xf.write('\n ')
+                        for element in elements:
+                            xf.write(element)
+            else:
+                write = output.write
+                write(b'<?xml version="1.0" encoding="UTF-8"?>\n<osm>\n ')
 
-            # Write every kth top level element
-            for i, element in enumerate(self.get_element()):
-                if i % k == 0:
-                    output.write(ET.tostring(element, encoding='utf-8'))
+                # Escaping is not cached here: most attribute values (ids, lat/lon, 
+                # timestamps) are unique, and an lru_cache on ElementTree's escape 
+                # functions made the writes slower on the sample file
+                for element in elements:
+                    write(ET.tostring(element, encoding='utf-8'))
 
-            output.write('</osm>')
+                write(b'</osm>')
 
     
\ No newline at end of file
@@ -48,16 +48,17 @@ specified schema.
 # Required python imports
 import pprint
 import re
-import xml.etree.cElementTree as ET
-from collections import defaultdict
+from collections import Counter, defaultdict
+from operator import itemgetter
 import pandas as pd
 import os
+import sqlite3
 import matplotlib.pyplot as plt
 
 # Custom python files for the project
-from osm_file import OSMFile  # OSM file handling script
-from audit_osm import auditOSM # Auditing script
-from clean_osm import cleanOSM # Cleaning script
+from osm_file import OSM_ELEMENTS, OSMFile, iter_children, iter_elements  # OSM file handling script
+from audit_osm import auditOSM, audit_many # Auditing script
+from clean_osm import build_expected_regex, cleanOSM, clean_city_name, clean_street_name, set_to_none # Cleaning script
 from convertToCSV import ConvertToCSV # Script to shape the data and save to csv
 from sql_db import dbSQL # Script for sqlite database
 
@@ -82,15 +83,14 @@ os.path.getsize(OSM_FILE) >> 20
 
 # Count all the tags in the osm fil
 def count_tags(filename):
-        # Create a dictionary of tags
-        tag_dict = {}
-        # Iteratively parse through the data and add all elements in the dictionary
-        for event, elem in ET.iterparse(filename):
-            if elem.tag not in tag_dict.keys():
-                tag_dict[elem.tag] = 1
-            else:
-                tag_dict[elem.tag] += 1
-        return tag_dict
+        # Count the tags, starting with the root element
+        tag_count = Counter(['osm'])
+        # Iteratively parse through the top level elements and count them, along with 
+        # their child elements
+        for element in iter_elements(filename, OSM_ELEMENTS):
+            for elem in element.iter():
+                tag_count[elem.tag] += 1
+        return dict(tag_count)
     
 tags = count_tags(OSM_FILE)
 # pprint.pprint(tags)
@@ -106,32 +106,24 @@ tags = count_tags(OSM_FILE)
 # Function to get the count of all 'k' attributes of 'tag' element and 
 # sort them by frequency of their occurence
 def get_keys_count(filename):    
-    all_keys = defaultdict(set)
-    sorted_keys = []
-    for event, elem in ET.iterparse(filename, events=("start",)):
-        if elem.tag == "node" or elem.tag == "way":
-            for tag in elem.iter("tag"):
-                if tag.attrib['k'] in all_keys.keys():
-                    all_keys[tag.attrib['k']] += 1
-                else:
-                    all_keys[tag.attrib['k']] = 1
+    all_keys = defaultdict(int)
+    for elem in iter_elements(filename, ('node', 'way')):
+        for tag in iter_children(elem, "tag"):
+            all_keys[tag.attrib['k']] += 1
                     
     # sort by value in descending order
-    for w in sorted(all_keys, key=all_keys.get, reverse=True):
-        sorted_keys.append((w, all_keys[w]))
-        
-    return sorted_keys
+    return sorted(all_keys.items(), key=itemgetter(1), reverse=True)
 
 # Count 'tag' elements 'k' attribute for the osm file
 all_keys = get_keys_count(OSM_FILE)
 
 # Get number of unique keys
-print len(all_keys)
+print(len(all_keys))
 # 862
 
 # Get top 20 keys used 
 for key in all_keys[0:20]:
-    print key   
+    print(key)   
 #('highway', 183227)
 #('source', 91029)
 #('building', 88605)
@@ -155,15 +147,20 @@ for key in all_keys[0:20]:
 
 # Few key attributes from top 20 most frequently occuring ones are chosen for auditing and cleaning.
 
+# Collect the values of all the keys for audit, with the number of tags having each value, 
+# in a single pass through the osm file
+key_values = audit_many(OSM_FILE, ['building', 'surface', 'oneway', 'addr:city', 
+                                   'addr:street:ar', 'name:ar', 'addr:street'])
+
 ##**************************##
 #      Audit building       ##
 ##**************************##
 
 # Audit building and get a list of all building types
-all_building = auditOSM(OSM_FILE, 'building').audit_key()
+all_building = list(key_values['building'])
 
-# cleaned expected_building list
-expected_building = ['bridge',
+# cleaned expected_building set
+expected_building = frozenset(['bridge',
  'shed',
  'industrial',
  'apartments',
@@ -217,11 +214,11 @@ expected_building = ['bridge',
  'tower',
  'retail',
  'storage_tank',
- 'greenhouse']
+ 'greenhouse'])
 
 # Audit against the expected values to get a list of dirty entries
-dirty_building_types = auditOSM(OSM_FILE, 'building', expected_building).audit_key()
-# print dirty_building_types
+dirty_building_types = [v for v in key_values['building'] if v not in expected_building]
+# print(dirty_building_types)
 # ['Office_And_entrance', 'office', 'Airport_terminal', 'Gate 3', 'Tourist_Exhibition', 'Offices', 'yes;mosque', 'MAJ Building', 'Complex_A_&_B']
 
 # map wrong entries to clean values
@@ -242,17 +239,17 @@ mapping_building = {
 #      Clean building       ##
 ##**************************##
 
-for building in auditOSM(OSM_FILE, 'building').audit_key():
-    print cleanOSM(building, mapping_building).clean_value()
+for building in cleanOSM.clean_map(key_values['building'], mapping_building):
+    print(building)
 
 ##**************************##
 #      Audit surface       ##
 ##**************************##
 
-all_surfaces = auditOSM(OSM_FILE, 'surface').audit_key()
+all_surfaces = list(key_values['surface'])
 
-# cleaned expected_surface list
-expected_surface = ['astroturf',
+# cleaned expected_surface set
+expected_surface = frozenset(['astroturf',
  'asphalt',
  'bricks',
  'wood',
@@ -284,11 +281,11 @@ expected_surface = ['astroturf',
  'sand',
  'dirt/sand',
  'paving_stone',
- 'grass']
+ 'grass'])
 
 # Get dirty surface entries by auditing against expected values
-dirty_surface_types = auditOSM(OSM_FILE, 'surface', expected_surface).audit_key()
-# print dirty_surface_types
+dirty_surface_types = [v for v in key_values['surface'] if v not in expected_surface]
+# print(dirty_surface_types)
 # ['unpaveds', 'running surface', 'asphalt`', 'Elevated', 'unpaved`', 'paving stones', 'paving_stoness', 'pavin', 'paving`']
 
 
@@ -307,8 +304,8 @@ mapping_surface = {'running surface': 'running_surface',
 #      Clean surface        ##
 ##**************************##
 
-for dirty_surface in auditOSM(OSM_FILE, 'surface').audit_key():
-    print cleanOSM(dirty_surface, mapping_surface).clean_value()
+for surface in cleanOSM.clean_map(key_values['surface'], mapping_surface):
+    print(surface)
     
 ##**************************##
 #      Audit oneway         ##
@@ -316,32 +313,24 @@ for dirty_surface in auditOSM(OSM_FILE, 'surface').audit_key():
 
 # get expected values of oneway from the wiki
 # Refer: https://wiki.openstreetmap.org/wiki/Key:oneway
-expected_oneway = ['yes','no','-1','reversible','alternating']
+expected_oneway = frozenset(['yes','no','-1','reversible','alternating'])
 
 # Find dirty values bu auditing against expected values
-dirty_oneway_types = auditOSM(OSM_FILE, 'oneway', expected_oneway).audit_key()
-# print dirty_oneway_types
+dirty_oneway_types = frozenset(v for v in key_values['oneway'] if v not in expected_oneway)
+# print(dirty_oneway_types)
 # ['Street 43', 'tertiary']
 
-# Count number of tags with wrong entries
-count = 0
-for event, elem in ET.iterparse(OSM_FILE, events=("start",)):
-    if elem.tag == "node" or elem.tag == "way":
-        for tag in elem.iter("tag"):
-            if tag.attrib['k'] == 'oneway':
-                if tag.attrib['v'] in dirty_oneway_types:
-                    count += 1
-                    
-                
-# print count
+# Count number of tags with wrong entries, from the number of tags per value in the audit
+count = sum(key_values['oneway'][v] for v in dirty_oneway_types)
+# print(count)
 # 6
 
 ##**************************##
 #      Clean oneway         ##
 ##**************************##
 
-for dirty_oneway in auditOSM(OSM_FILE, 'oneway').audit_key():
-    print cleanOSM(dirty_oneway).set_to_none()
+for dirty_oneway in key_values['oneway']:
+    print(set_to_none())
     
 ##**************************##
 #      Audit addr:city      ##
@@ -354,8 +343,10 @@ expected_cities = ['Abu Dhabi','Dubai','Dibba Al-Fujairah','Al Ain','Fujairah','
                    'Al Karama','Al Samha', 'Umm Al Quwain','Ras al Khaimah','Yas Island','Hatta']
 
 
-# Audit city entry against expected_cities list and extract those which do not feature in the list
-all_cities = auditOSM(OSM_FILE, 'addr:city', expected_cities).audit_key()
+# Audit city entry against expected_cities list and extract those which do not feature in the list.
+# The list is looked up as a set, it is kept as a list for cleaning where its order matters
+expected_city_set = frozenset(expected_cities)
+all_cities = [v for v in key_values['addr:city'] if v not in expected_city_set]
 
 # ap some of the spelling mistakes etc. to the clean values
 mapping_city = {
@@ -385,19 +376,19 @@ mapping_city = {
 ##**************************##
 
 for city in all_cities:
-    print city, ' => ', cleanOSM(city, mapping_city, expected_cities).clean_city_name()
+    print(city, ' => ', clean_city_name(city, mapping_city, expected_cities))
 
 ##**************************##
 #   Audit arabic entries    ##
 ##**************************##
 
 ## addr:street:ar
-for street in auditOSM(OSM_FILE, 'addr:street:ar').audit_key()[0:10]:
-    print street
+for street in list(key_values['addr:street:ar'])[0:10]:
+    print(street)
     
 ## name:ar
-for name in auditOSM(OSM_FILE, 'name:ar').audit_key()[0:10]:
-    print name    
+for name in list(key_values['name:ar'])[0:10]:
+    print(name)    
     
 # All such tags to be ignored.
 
@@ -410,7 +401,10 @@ expected = ["Street", "Avenue", "Boulevard", "Drive", "Court", "Place", "Square"
             "Link","Track","Corniche"]
 
 # Audit with the expected list of street types and find types not in the list
-street_types = auditOSM(OSM_FILE,'addr:street', expected).audit_street()
+street_types = defaultdict(set)
+street_audit = auditOSM(OSM_FILE, 'addr:street', expected)
+for street_name in key_values['addr:street']:
+    street_audit.audit_street_type(street_types, street_name)
 pprint.pprint(dict(street_types))
 
 # Mapping dictionary for correcting the discrepancies in the street name
@@ -448,9 +442,12 @@ mapping = { "St.": "Street",
 ##**************************##
 #     Clean addr:street     ##
 ##**************************##
-for _, ways in street_types.iteritems():
-    for name in ways:
-        print name, "=>", cleanOSM(name, mapping, expected).clean_street_name()
+# Clean each street name once, then print from the cleaned names
+expected_regex = build_expected_regex(expected)
+clean_street_names = {name: clean_street_name(name, mapping, expected, expected_regex) 
+                      for names in street_types.values() for name in names}
+for name, clean_name in clean_street_names.items():
+    print(name, "=>", clean_name)
         
 ##**************************##
 #     Convert to csv        ##
@@ -462,10 +459,11 @@ ConvertToCSV(OSM_FILE, validate=True).process_map()
 #  Create database tables   ##
 ##**************************##
 
+# lat and lon are stored as integers in units of 1e-7 degree, eg: lat/1e7 gives the degrees
 nodes_schema = """CREATE TABLE nodes (
     id INTEGER PRIMARY KEY NOT NULL,
-    lat REAL,
-    lon REAL,
+    lat INTEGER,
+    lon INTEGER,
     user TEXT,
     uid INTEGER,
     version INTEGER,
@@ -508,20 +506,18 @@ ways_nodes_schema = """CREATE TABLE ways_nodes (
 
 db = dbSQL()
 
-db.create_table('nodes', nodes_schema)
-db.insert_data('nodes', NODES_PATH)
-
-db.create_table('nodes_tags', nodes_tags_schema)
-db.insert_data('nodes_tags', NODE_TAGS_PATH)
-
-db.create_table('ways', ways_schema)
-db.insert_data('ways', WAYS_PATH)
-
-db.create_table('ways_tags', ways_tags_schema)
-db.insert_data('ways_tags', WAY_TAGS_PATH)
+db.load_tables([('nodes', nodes_schema, NODES_PATH),
+                ('nodes_tags', nodes_tags_schema, NODE_TAGS_PATH),
+                ('ways', ways_schema, WAYS_PATH),
+                ('ways_tags', ways_tags_schema, WAY_TAGS_PATH),
+                ('ways_nodes', ways_nodes_schema, WAY_NODES_PATH)])
 
-db.create_table('ways_nodes', ways_nodes_schema)
-db.insert_data('ways_nodes', WAY_NODES_PATH)
+# Index the tables by element id for the queries, only after all the data is inserted.
+# nodes and ways need none, as their 'INTEGER PRIMARY KEY' id is the sqlite rowid itself, 
+# which is appended to cheaply since the ids in the osm file are in ascending order
+db.create_index('idx_nodes_tags_id', 'nodes_tags', ['id'])
+db.create_index('idx_ways_tags_id', 'ways_tags', ['id'])
+db.create_index('idx_ways_nodes_id', 'ways_nodes', ['id'])
 
 db.close_connection()
 
@@ -534,17 +530,17 @@ c = conn.cursor()
 
 # Number of unique user
 cursor = conn.execute("SELECT COUNT(DISTINCT(uid)) from nodes")
-print "Unique uid count  = ", cursor.fetchone()[0]
+print("Unique uid count  = ", cursor.fetchone()[0])
 # Unique uid count  =  2450
 
 # Number of nodes
 cursor = conn.execute("SELECT COUNT(*) FROM nodes")
-print "Node count  = ", cursor.fetchone()[0]
+print("Node count  = ", cursor.fetchone()[0])
 # Node count  =  2431529
 
 # Number of ways
 cursor = conn.execute("SELECT COUNT(*) FROM ways")
-print "Way count  = ", cursor.fetchone()
+print("Way count  = ", cursor.fetchone())
 # Way count  =  (324346,)
 
 # Top ten users
@@ -562,13 +558,13 @@ df[0:10]
 # Way with maximum number of nodes
 cursor = conn.execute("SELECT A.id, MAX(A.node_count) FROM (SELECT id, COUNT(node_id) AS node_count FROM ways_nodes \
                     GROUP BY id) A")
-print "(Tag Id, Node Count)  = ", cursor.fetchall()
+print("(Tag Id, Node Count)  = ", cursor.fetchall())
 # Node count  =  [(404074917, 1960)]
 
 # All way tags with number of nodes more than 1000
 cursor = conn.execute("SELECT A.id, A.node_count FROM (SELECT id, COUNT(node_id) AS node_count FROM ways_nodes \
                     GROUP BY id) A WHERE A.node_count > 1000")
-print "(Tag Id, Node Count) = ", cursor.fetchall()
+print("(Tag Id, Node Count) = ", cursor.fetchall())
 # (Tag Id, Node Count) =  [(170139278, 1086), (171171012, 1075), (194470882, 1094), (205958924, 1226), (216720271, 1628), (393225171, 1408), (393249907, 1434), (393254003, 1180), (393420807, 1266), (402883870, 1592), (402884861, 1450), (404074917, 1960), (404089376, 1469), (440574399, 1062), (440574403, 1133), (440574568, 1524), (440574586, 1264)]
 
 # Count the number of keys for each of these ids
@@ -576,13 +572,13 @@ cursor = conn.execute("SELECT COUNT(ways_tags.key) FROM ways_tags \
                     WHERE id IN (SELECT A.id FROM (SELECT id, COUNT(node_id) AS node_count FROM ways_nodes \
                     GROUP BY id) A WHERE A.node_count > 1000) \
                     GROUP BY id")
-print "Associated keys and values  = ", cursor.fetchall()
+print("Associated keys and values  = ", cursor.fetchall())
 # Associated keys and values  =  [(10,), (2,), (2,), (2,), (2,), (2,), (1,), (1,), (3,), (3,), (3,), (3,)]
 
 ## What is the feature here??
 cursor = conn.execute("SELECT key, value FROM ways_tags \
                         WHERE id = '402884861'")
-print "Associated keys and values  = ", cursor.fetchall()
+print("Associated keys and values  = ", cursor.fetchall())
 # Associated keys and values  =  [(u'natural', u'coastline')]
 
 # Number of rows in ways_tags grouped by keys
@@ -8,8 +8,8 @@ schema = {
         'type': 'dict',
         'schema': {
             'id': {'required': True, 'type': 'integer', 'coerce': int},
-            'lat': {'required': True, 'type': 'float', 'coerce': float},
-            'lon': {'required': True, 'type': 'float', 'coerce': float},
+            'lat': {'required': True, 'type': 'integer', 'coerce': int},
+            'lon': {'required': True, 'type': 'integer', 'coerce': int},
             'user': {'required': True, 'type': 'string'},
             'uid': {'required': True, 'type': 'integer', 'coerce': int},
             'version': {'required': True, 'type': 'string'},
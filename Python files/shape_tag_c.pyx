@@ -0,0 +1,44 @@
+# cython: language_level=3
+"""
+Compiled version of shape_tag from convertToCSV, used in place of the Python
+function when built. Build in this directory with:
+
+    cythonize -i shape_tag_c.pyx
+
+The cleaning functions are passed in as a dict to avoid importing convertToCSV.
+"""
+
+
+cdef inline bint is_lower_word(str s):
+    """Return True if s is non-empty and only has characters in [a-z_]"""
+    cdef Py_UCS4 c
+    if not s:
+        return False
+    for c in s:
+        if not (u'a' <= c <= u'z' or c == u'_'):
+            return False
+    return True
+
+
+cpdef dict shape_tag(str elem_id, str k, str v, str default_tag_type, dict cleaners):
+    """Clean the value of a secondary tag and shape it to Python dict"""
+    cdef dict tag_attrib = {}
+    cdef str tag_type, colon, key
+    cdef Py_UCS4 first
+    tag_attrib['id'] = elem_id
+
+    cleaner = cleaners.get(k)
+    tag_attrib['value'] = cleaner(v) if cleaner is not None else v
+
+    # Same as matching r'^([a-z]|_)+:([a-z]|_)+'
+    tag_type, colon, key = k.partition(u':')
+    if colon and key:
+        first = key[0]
+        if (u'a' <= first <= u'z' or first == u'_') and is_lower_word(tag_type):
+            tag_attrib['type'] = tag_type
+            tag_attrib['key'] = key
+            return tag_attrib
+
+    tag_attrib['key'] = k
+    tag_attrib['type'] = default_tag_type
+    return tag_attrib